@@ -1,18 +1,18 @@
-import heapq
 import logging
-from dataclasses import dataclass, field
-from typing import List, Literal
+import sys
+import threading
+from collections import deque
+from dataclasses import dataclass
+from itertools import islice
+from typing import Deque, Dict, Iterable, List, Literal, Optional, Tuple
 
-# ——— Data models ———
+from sortedcontainers import SortedList
+
+logger = logging.getLogger(__name__)
 
-@dataclass(order=True)
-class HeapItem:
-    # The heap will sort by priority first, then count (to break ties in insertion order)
-    priority: float
-    count: int
-    order: "Order" = field(compare=False)
+# ——— Data models ———
 
-@dataclass
+@dataclass(slots=True)
 class Order:
     type_op: Literal["CREATE"]
     account_id: str
@@ -22,14 +22,14 @@ class Order:
     limit_price: float
     side: Literal["BUY", "SELL"]
 
-@dataclass
+@dataclass(slots=True)
 class Trade:
     buy_order: Order
     sell_order: Order
     amount_traded: int
     selling_price: float
 
-@dataclass
+@dataclass(slots=True)
 class OrderBookEntry:
     order_id: str
     side: str
@@ -39,97 +39,311 @@ class OrderBookEntry:
 
 # ——— Core matching engine ———
 
-class OrderOrch:
-    def __init__(self):
-        self.buy_heap: List[HeapItem] = []
-        self.sell_heap: List[HeapItem] = []
-        self.trades: List[Trade] = []
-        self.order_book: List[OrderBookEntry] = []
-        self._counter = 0
-        logging.basicConfig(level=logging.INFO)
+class PairEngine:
+    """Order book and matching for a single trading pair."""
+
+    def __init__(self, trades: List[Trade], order_book: List[OrderBookEntry]):
+        # Active price levels in ascending order: best bid is bids[-1], best ask asks[0]
+        self.bids: SortedList = SortedList()
+        self.asks: SortedList = SortedList()
+        # FIFO queue of resting orders at each price level
+        self.bid_q: Dict[float, Deque[Order]] = {}
+        self.ask_q: Dict[float, Deque[Order]] = {}
+        # Shared with the other pairs' engines
+        self.trades = trades
+        self.order_book = order_book
+        # Resting orders per account, keyed by id() so removal is O(1)
+        self.pending_by_account: Dict[str, Dict[int, Order]] = {}
+        # Bumped on every change to the book, for readers caching derived views
+        self._version = 0
+        # Serializes add_order; readers walking the book or index take it too
+        self.lock = threading.Lock()
 
     def add_order(self, order: Order):
-        """Insert an order into the appropriate heap, then attempt matching."""
-        self._counter += 1
-        if order.side == "BUY":
-            # Max-heap for buys: invert the price
-            item = HeapItem(priority=-order.limit_price, count=self._counter, order=order)
-            heapq.heappush(self.buy_heap, item)
-        else:
-            # Min-heap for sells: natural price order
-            item = HeapItem(priority=order.limit_price, count=self._counter, order=order)
-            heapq.heappush(self.sell_heap, item)
-        self._match_orders()
+        """Match an incoming order against the book, then queue any remainder."""
+        with self.lock:
+            self._version += 1
+            self._match_incoming(order)
+            if order.amount > 0:
+                self._push_order(order)
 
-    def _pop_order(self, heap: List[HeapItem]) -> Order:
-        """Helper to pop a HeapItem and return its Order."""
-        return heapq.heappop(heap).order
+    def add_orders(self, orders: List[Order]):
+        """Queue a batch of orders together, then match the book in a single pass."""
+        with self.lock:
+            self._version += 1
+            self._push_orders(orders)
+            self._match_orders()
+
+    def _pop_at(self, prices: SortedList, levels: Dict[float, Deque[Order]],
+                price: float, i: int) -> Order:
+        """Remove the order at index ``i`` of a price level, dropping the level once empty."""
+        queue = levels[price]
+        if i:
+            order = queue[i]
+            del queue[i]
+        else:
+            order = queue.popleft()
+        if not queue:
+            del levels[price]
+            prices.remove(price)
+        pending = self.pending_by_account[order.account_id]
+        del pending[id(order)]
+        if not pending:
+            del self.pending_by_account[order.account_id]
+        return order
 
     def _push_order(self, order: Order):
-        """Helper to re‐insert a leftover order back into the correct heap."""
-        self._counter += 1
+        """Helper to queue an order at the back of its price level."""
         if order.side == "BUY":
-            heapq.heappush(self.buy_heap,
-                           HeapItem(priority=-order.limit_price, count=self._counter, order=order))
+            prices, levels = self.bids, self.bid_q
         else:
-            heapq.heappush(self.sell_heap,
-                           HeapItem(priority=order.limit_price, count=self._counter, order=order))
+            prices, levels = self.asks, self.ask_q
+        queue = levels.get(order.limit_price)
+        if queue is None:
+            queue = levels[order.limit_price] = deque()
+            prices.add(order.limit_price)
+        queue.append(order)
+        self.pending_by_account.setdefault(order.account_id, {})[id(order)] = order
+
+    def _push_orders(self, orders: Iterable[Order]):
+        """Queue many orders, adding their new price levels to the sorted prices in bulk."""
+        new_bids: List[float] = []
+        new_asks: List[float] = []
+        for order in orders:
+            if order.side == "BUY":
+                levels, new_prices = self.bid_q, new_bids
+            else:
+                levels, new_prices = self.ask_q, new_asks
+            queue = levels.get(order.limit_price)
+            if queue is None:
+                queue = levels[order.limit_price] = deque()
+                new_prices.append(order.limit_price)
+            queue.append(order)
+            self.pending_by_account.setdefault(order.account_id, {})[id(order)] = order
+        self.bids.update(new_bids)
+        self.asks.update(new_asks)
+
+    def _best_counterparty(self, levels: Dict[float, Deque[Order]], prices: Iterable[float],
+                           account_id: str, start: Optional[Tuple[float, int]] = None
+                           ) -> Tuple[Optional[Tuple[float, int]], Optional[Tuple[float, int]]]:
+        """
+        (price, index) of the first queued order, walking ``prices`` best
+        first, that is not owned by ``account_id``, or None; and the
+        (price, index) the walk reached. A later walk for the same account can
+        pass that back as ``start`` to skip the orders already known to be its own.
+        """
+        start_price, start_i = start if start is not None else (None, 0)
+        reached = start
+        for price in prices:
+            queue = levels[price]
+            first = start_i if price == start_price else 0
+            for i, order in enumerate(islice(queue, first, None), first):
+                if order.account_id != account_id:
+                    return (price, i), (price, i)
+            reached = (price, len(queue))
+        return None, reached
 
     def _match_orders(self):
-        """Try to match as many orders as possible."""
-        while True:
-            removed_for_matching: List[Order] = []
-            trade_occurred = False
-
-            # Drain top of heaps while possible
-            while self.buy_heap and self.sell_heap:
-                buy = self._pop_order(self.buy_heap)
-                sell = self._pop_order(self.sell_heap)
-
-                # Skip same‐account matches by parking the buy order
-                if buy.account_id == sell.account_id:
-                    removed_for_matching.append(buy)
-                    self._push_order(sell)
+        """Match crossing orders already resting in the book, as many as possible."""
+        # Bind the books once: the loop below is the hot path
+        bids, asks, bid_q, ask_q = self.bids, self.asks, self.bid_q, self.ask_q
+        pop_at = self._pop_at
+        trades: List[Trade] = []
+        order_book: List[OrderBookEntry] = []
+        # Where the last same-account walk of each side stopped, as
+        # (account_id, (price, index)): that account owns everything ahead of it.
+        # Only valid because the sweep never inserts orders, so the best ask
+        # only rises and the best bid only falls; a side's skip must be reset
+        # whenever a fill ahead of it (e.g. of that side's top order) could
+        # shift the indexes it points at.
+        bid_skip = ask_skip = None
+        try:
+            while bids and asks:
+                bid_price, ask_price = bids[-1], asks[0]
+                if bid_price < ask_price:
+                    break
+                buy_i = sell_i = 0
+
+                # Same‐account top of book: find the best buy for the top sell,
+                # else the best sell for the top buy, among crossing levels only
+                account_id = ask_q[ask_price][0].account_id
+                if bid_q[bid_price][0].account_id != account_id:
+                    bid_skip = ask_skip = None
+                else:
+                    start = bid_skip[1] if bid_skip and bid_skip[0] == account_id else None
+                    found, reached = self._best_counterparty(
+                        bid_q, bids.irange(minimum=ask_price,
+                                           maximum=start[0] if start else None, reverse=True),
+                        account_id, start)
+                    bid_skip = (account_id, reached) if reached else None
+                    if found is not None:
+                        bid_price, buy_i = found
+                        # Filling the top sell shifts the sell side under ask_skip
+                        ask_skip = None
+                    else:
+                        start = ask_skip[1] if ask_skip and ask_skip[0] == account_id else None
+                        found, reached = self._best_counterparty(
+                            ask_q, asks.irange(minimum=start[0] if start else None,
+                                               maximum=bid_price),
+                            account_id, start)
+                        ask_skip = (account_id, reached) if reached else None
+                        if found is None:
+                            break
+                        ask_price, sell_i = found
+
+                buy = bid_q[bid_price][buy_i]
+                sell = ask_q[ask_price][sell_i]
+                self._execute(buy, sell, trades, order_book)
+
+                # Only a filled order leaves its level; a partial fill keeps its place
+                if buy.amount == 0:
+                    pop_at(bids, bid_q, bid_price, buy_i)
+                if sell.amount == 0:
+                    pop_at(asks, ask_q, ask_price, sell_i)
+        finally:
+            # Publish fills made so far even if the pass fails part way
+            self._flush(trades, order_book)
+
+    def _match_incoming(self, order: Order):
+        """
+        Trade an order that is not yet in the book against the opposite side
+        until it is filled or no longer crosses.
+
+        Resting orders that are only partially filled keep their place and are
+        updated in place, so the common fill touches neither the price levels
+        nor the incoming order's own side.
+        """
+        buy_side = order.side == "BUY"
+        if buy_side:
+            prices, levels = self.asks, self.ask_q
+        else:
+            prices, levels = self.bids, self.bid_q
+        account_id = order.account_id
+        trades: List[Trade] = []
+        order_book: List[OrderBookEntry] = []
+        skipped = 0  # crossing levels that only hold this account's orders
+        start = 0    # this account's orders already passed over in the current level
+        try:
+            while order.amount > 0 and skipped < len(prices):
+                if buy_side:
+                    price = prices[skipped]
+                    if price > order.limit_price:
+                        break
+                else:
+                    price = prices[-1 - skipped]
+                    if price < order.limit_price:
+                        break
+
+                queue = levels[price]
+                for i, resting in enumerate(islice(queue, start, None), start):
+                    if resting.account_id != account_id:
+                        break
+                else:
+                    skipped += 1
+                    start = 0
                     continue
 
-                # If prices cross, execute trade
-                if buy.limit_price >= sell.limit_price:
-                    qty = min(buy.amount, sell.amount)
-                    price = sell.limit_price
-                    logging.info(f"Trade: {qty}@{price} between {buy.account_id}↔{sell.account_id}")
-
-                    # Record the trade
-                    trade = Trade(buy_order=buy, sell_order=sell,
-                                  amount_traded=qty, selling_price=price)
-                    self.trades.append(trade)
-
-                    # Record in order book
-                    self.order_book.append(OrderBookEntry(
-                        order_id=buy.order_id, side=buy.side,
-                        amount=qty, price=price, account_id=buy.account_id))
-                    self.order_book.append(OrderBookEntry(
-                        order_id=sell.order_id, side=sell.side,
-                        amount=qty, price=price, account_id=sell.account_id))
-
-                    # Push back any remaining quantity
-                    buy.amount -= qty
-                    sell.amount -= qty
-                    if buy.amount > 0:
-                        self._push_order(buy)
-                    if sell.amount > 0:
-                        self._push_order(sell)
-
-                    trade_occurred = True
+                if buy_side:
+                    self._execute(order, resting, trades, order_book)
                 else:
-                    # No price match: put them back and stop
-                    self._push_order(buy)
-                    self._push_order(sell)
-                    break
+                    self._execute(resting, order, trades, order_book)
+                if resting.amount == 0:
+                    self._pop_at(prices, levels, price, i)
+                    start = i
+        finally:
+            # Publish fills made so far even if the pass fails part way
+            self._flush(trades, order_book)
+
+    def _flush(self, trades: List[Trade], order_book: List[OrderBookEntry]):
+        """Publish the trades of one matching pass with a single extend per list."""
+        if trades:
+            self.trades.extend(trades)
+            self.order_book.extend(order_book)
+
+    def _execute(self, buy: Order, sell: Order,
+                 trades: List[Trade], order_book: List[OrderBookEntry]):
+        """
+        Trade as much as both orders allow at the sell price, recording it in
+        the given lists, which the caller flushes to the shared ones.
+        """
+        qty = min(buy.amount, sell.amount)
+        price = sell.limit_price
+        logger.info("Trade: %s@%s between %s↔%s", qty, price, buy.account_id, sell.account_id)
+
+        # Record the trade
+        trade = Trade(buy_order=buy, sell_order=sell,
+                      amount_traded=qty, selling_price=price)
+        trades.append(trade)
+
+        # Record in order book
+        order_book.append(OrderBookEntry(
+            order_id=buy.order_id, side=buy.side,
+            amount=qty, price=price, account_id=buy.account_id))
+        order_book.append(OrderBookEntry(
+            order_id=sell.order_id, side=sell.side,
+            amount=qty, price=price, account_id=sell.account_id))
+
+        buy.amount -= qty
+        sell.amount -= qty
+
+
+class OrderOrch:
+    """Routes each order to the PairEngine for its pair."""
+
+    def __init__(self):
+        self.engines: Dict[str, PairEngine] = {}
+        # Shared by all pairs so trades stay in execution order
+        self.trades: List[Trade] = []
+        self.order_book: List[OrderBookEntry] = []
+
+    def add_order(self, order: Order):
+        """Hand an order to its pair's engine."""
+        self._intern(order)
+        self._engine(order.pair).add_order(order)
+
+    def add_orders(self, orders: List[Order]):
+        """Hand a batch of orders to their pairs' engines, one batch per pair."""
+        by_pair: Dict[str, List[Order]] = {}
+        for order in orders:
+            self._intern(order)
+            by_pair.setdefault(order.pair, []).append(order)
+        for pair, batch in by_pair.items():
+            self._engine(pair).add_orders(batch)
+
+    def _intern(self, order: Order):
+        """Intern an order's ids so the per-match account comparisons are identity checks."""
+        order.account_id = sys.intern(order.account_id)
+        order.pair = sys.intern(order.pair)
 
-            # Re‐insert any parked orders for next pass
-            for o in removed_for_matching:
-                self._push_order(o)
+    def _engine(self, pair: str) -> PairEngine:
+        """The engine for ``pair``, created on first use."""
+        book = self.engines.get(pair)
+        if book is None:
+            book = self.engines.setdefault(pair, PairEngine(self.trades, self.order_book))
+        return book
 
-            if not trade_occurred:
-                break
+    def version(self) -> Tuple[int, ...]:
+        """Changes whenever any pair's book changes, for readers caching derived views."""
+        return tuple(book._version for book in list(self.engines.values()))
 
+    def pending_orders(self) -> Dict[str, List[dict]]:
+        """
+        Snapshot of the resting orders of every pair, grouped by account_id.
+        Rows are copied under each book's lock, so they cannot change afterwards.
+        """
+        pending: Dict[str, List[dict]] = {}
+        for book in list(self.engines.values()):
+            with book.lock:
+                for account_id, orders in book.pending_by_account.items():
+                    pending.setdefault(account_id, []).extend(
+                        {
+                            "order_id": o.order_id,
+                            "account_id": o.account_id,
+                            "pair": o.pair,
+                            "side": o.side,
+                            "amount": o.amount,
+                            "limit_price": o.limit_price,
+                        }
+                        for o in orders.values()
+                    )
+        return pending
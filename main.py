@@ -1,8 +1,38 @@
-from fastapi import FastAPI
+import json
+import logging
+import queue
+import threading
+from contextlib import asynccontextmanager
+from dataclasses import fields
+
+import anyio.to_thread
+from fastapi import FastAPI, Response
+from fastapi.responses import JSONResponse, ORJSONResponse
 from pydantic import BaseModel, Field
-from typing import Literal, List, Dict
+from typing import List, Literal, Optional, Tuple, Union
+
+from engine import OrderOrch, Order
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:  # orjson has no PyPy build
+    orjson = None
+
+# ---- JSON encoding ----
+if orjson is not None:
+    dumps = orjson.dumps
+    DefaultResponse = ORJSONResponse
+else:
+    def dataclass_fields(obj):
+        return {f.name: getattr(obj, f.name) for f in fields(obj)}
 
-from engine import OrderOrch, Order, Trade, OrderBookEntry
+    def dumps(obj) -> bytes:
+        return json.dumps(obj, default=dataclass_fields, ensure_ascii=False,
+                          separators=(",", ":")).encode()
+
+    DefaultResponse = JSONResponse
 
 # ---- Pydantic models ----
 class OrderIn(BaseModel):
@@ -14,40 +44,18 @@ class OrderIn(BaseModel):
     limit_price: float = Field(..., gt=0)
     side: Literal["BUY", "SELL"]
 
-class TradeOut(BaseModel):
-    buy_order: dict
-    sell_order: dict
-    amount_traded: int
-    selling_price: float
-
-class OrderBookEntryOut(BaseModel):
-    order_id: str
-    side: str
-    amount: int
-    price: float
-    account_id: str
-
-class PendingOrder(BaseModel):
-    order_id: str
-    account_id: str
-    pair: str
-    side: Literal["BUY", "SELL"]
-    amount: int
-    limit_price: float
-
 # ---- App & Engine ----
-app = FastAPI(title="Order Matching API")
+logging.basicConfig(level=logging.INFO)
 engine = OrderOrch()
-# Track all seen account_ids
-account_ids_set = set()
+# Orders and order batches waiting for the matcher thread, in arrival order
+order_queue: "queue.SimpleQueue[Optional[Union[Order, List[Order]]]]" = queue.SimpleQueue()
+# Last /orders/pending body as (engine version, JSON bytes)
+pending_cache: Tuple[Tuple[int, ...], bytes] = ((-1,), b"")
+# /orderbook body as (entries encoded, JSON bytes); entries never change once appended
+orderbook_cache: Tuple[int, bytes] = (0, b"[]")
 
-# ---- Endpoints ----
-@app.post("/orders", status_code=201)
-def create_order(order_in: OrderIn):
-    """
-    Submit a new order. Attempts to match immediately.
-    """
-    order = Order(
+def to_order(order_in: OrderIn) -> Order:
+    return Order(
         type_op=order_in.type_op,
         account_id=order_in.account_id,
         amount=order_in.amount,
@@ -56,67 +64,94 @@ def create_order(order_in: OrderIn):
         limit_price=order_in.limit_price,
         side=order_in.side,
     )
-    engine.add_order(order)
-    account_ids_set.add(order.account_id)
-    return {"message": "Order accepted and processed"}
 
-@app.get("/trades", response_model=List[TradeOut])
+def match_forever():
+    """
+    Feed queued orders to the engine until a None sentinel arrives.
+    This thread is the only writer to the engine.
+    """
+    while True:
+        item = order_queue.get()
+        if item is None:
+            return
+        try:
+            if isinstance(item, list):
+                engine.add_orders(item)
+            else:
+                engine.add_order(item)
+        except Exception:
+            logger.exception("Matching failed for %r", item)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    matcher = threading.Thread(target=match_forever, name="matcher", daemon=True)
+    matcher.start()
+    yield
+    order_queue.put(None)
+    # Let the matcher drain the queue without blocking the event loop
+    await anyio.to_thread.run_sync(matcher.join)
+
+app = FastAPI(title="Order Matching API", default_response_class=DefaultResponse,
+              lifespan=lifespan)
+
+# ---- Endpoints ----
+@app.post("/orders", status_code=202)
+def create_order(order_in: OrderIn):
+    """
+    Submit a new order. It is queued for the matcher and matched in
+    arrival order; results show up in /trades and /orders/pending.
+    """
+    order_queue.put(to_order(order_in))
+    return {"message": "Order accepted"}
+
+@app.post("/orders/batch", status_code=202)
+def create_orders(orders_in: List[OrderIn]):
+    """
+    Submit many orders at once. Each pair's orders are queued together,
+    then matched in a single pass as if they had arrived simultaneously.
+    """
+    order_queue.put([to_order(o) for o in orders_in])
+    return {"message": f"{len(orders_in)} orders accepted"}
+
+# Engine dataclasses go straight to the encoder (orjson handles them natively);
+# returning a response directly skips FastAPI's own encoder.
+@app.get("/trades")
 def list_trades():
     """
     List all executed trades.
     """
-    out: List[TradeOut] = []
-    for t in engine.trades:
-        out.append(TradeOut(
-            buy_order=t.buy_order.__dict__,
-            sell_order=t.sell_order.__dict__,
-            amount_traded=t.amount_traded,
-            selling_price=t.selling_price,
-        ))
-    return out
-
-@app.get("/orderbook", response_model=List[OrderBookEntryOut])
+    return Response(content=dumps(engine.trades), media_type="application/json")
+
+@app.get("/orderbook")
 def list_orderbook():
     """
     List all order book entries from trades.
+    Only entries appended since the previous call are encoded.
     """
-    return [OrderBookEntryOut(**e.__dict__) for e in engine.order_book]
+    global orderbook_cache
+    encoded, body = orderbook_cache
+    count = len(engine.order_book)
+    if count > encoded:
+        new = dumps(engine.order_book[encoded:count])
+        body = body[:-1] + b"," + new[1:] if encoded else new
+        orderbook_cache = (count, body)
+    return Response(content=body, media_type="application/json")
 
-@app.get("/orders/pending", response_model=Dict[str, List[PendingOrder]])
+@app.get("/orders/pending")
 def list_all_pending_orders():
     """
-    Return all unmatched (pending) orders grouped by account_id.
+    Return all unmatched (pending) orders grouped by account_id, for
+    accounts that have any. Served from a cached body until the engine changes.
     """
-    result: Dict[str, List[PendingOrder]] = {}
-    # Iterate over every known account
-    for acct in account_ids_set:
-        pending: List[PendingOrder] = []
-        # Scan buy heap
-        for item in engine.buy_heap:
-            o = item.order
-            if o.account_id == acct:
-                pending.append(PendingOrder(
-                    order_id=o.order_id,
-                    account_id=o.account_id,
-                    pair=o.pair,
-                    side=o.side,
-                    amount=o.amount,
-                    limit_price=o.limit_price,
-                ))
-        # Scan sell heap
-        for item in engine.sell_heap:
-            o = item.order
-            if o.account_id == acct:
-                pending.append(PendingOrder(
-                    order_id=o.order_id,
-                    account_id=o.account_id,
-                    pair=o.pair,
-                    side=o.side,
-                    amount=o.amount,
-                    limit_price=o.limit_price,
-                ))
-        result[acct] = pending
-    return result
+    global pending_cache
+    version, body = pending_cache
+    current = engine.version()
+    if version != current:
+        body = dumps(engine.pending_orders())
+        pending_cache = (current, body)
+    return Response(content=body, media_type="application/json")
 
 # To run:
 # uvicorn main:app --reload
+# The service also runs under PyPy, or under CPython 3.13+ built with the
+# experimental JIT enabled via: PYTHON_JIT=1 uvicorn main:app
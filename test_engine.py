@@ -0,0 +1,216 @@
+import logging
+import random
+import unittest
+
+from engine import Order, OrderOrch, PairEngine
+
+logging.disable(logging.CRITICAL)
+
+
+class NaivePairEngine(PairEngine):
+    """PairEngine whose sweep re-walks the book from the top on every collision."""
+
+    def _match_orders(self):
+        bids, asks, bid_q, ask_q = self.bids, self.asks, self.bid_q, self.ask_q
+        trades, order_book = [], []
+        while bids and asks and bids[-1] >= asks[0]:
+            bid_price, ask_price = bids[-1], asks[0]
+            buy_i = sell_i = 0
+            account_id = ask_q[ask_price][0].account_id
+            if bid_q[bid_price][0].account_id == account_id:
+                found, _ = self._best_counterparty(
+                    bid_q, bids.irange(minimum=ask_price, reverse=True), account_id)
+                if found is not None:
+                    bid_price, buy_i = found
+                else:
+                    found, _ = self._best_counterparty(
+                        ask_q, asks.irange(maximum=bid_price), account_id)
+                    if found is None:
+                        break
+                    ask_price, sell_i = found
+
+            buy = bid_q[bid_price][buy_i]
+            sell = ask_q[ask_price][sell_i]
+            self._execute(buy, sell, trades, order_book)
+            if buy.amount == 0:
+                self._pop_at(bids, bid_q, bid_price, buy_i)
+            if sell.amount == 0:
+                self._pop_at(asks, ask_q, ask_price, sell_i)
+        self._flush(trades, order_book)
+
+
+def reference_add_order(resting, trades, order, seq):
+    """Brute-force price-time matching of ``order`` against ``resting`` (seq, Order) pairs."""
+    while order.amount > 0:
+        candidates = [(seq_, o) for seq_, o in resting
+                      if o.side != order.side and o.account_id != order.account_id
+                      and (o.limit_price <= order.limit_price if order.side == "BUY"
+                           else o.limit_price >= order.limit_price)]
+        if not candidates:
+            break
+        sign = 1 if order.side == "BUY" else -1
+        seq_, best = min(candidates, key=lambda c: (sign * c[1].limit_price, c[0]))
+        buy, sell = (order, best) if order.side == "BUY" else (best, order)
+        qty = min(buy.amount, sell.amount)
+        trades.append((buy.order_id, sell.order_id, qty, sell.limit_price))
+        buy.amount -= qty
+        sell.amount -= qty
+        if best.amount == 0:
+            resting.remove((seq_, best))
+    if order.amount > 0:
+        resting.append((seq, order))
+
+
+def random_batches(seed):
+    rng = random.Random(seed)
+    dominant = rng.choice([0.5, 0.8, 0.95])
+    batches = []
+    for k in range(rng.randint(1, 20)):
+        batch = []
+        for i in range(rng.randint(1, 150)):
+            if rng.random() < dominant:
+                account_id = rng.choice(["big", "big", "other_big"])
+            else:
+                account_id = rng.choice("xyz")
+            batch.append((account_id, rng.randint(1, 20), f"{k}-{i}",
+                          float(rng.randint(95, 105)), rng.choice(["BUY", "SELL"])))
+        batches.append(batch)
+    return batches
+
+
+def run(engine, batches):
+    for batch in batches:
+        engine.add_orders([Order(type_op="CREATE", account_id=a, amount=amt, order_id=oid,
+                                 pair="P", limit_price=price, side=side)
+                           for a, amt, oid, price, side in batch])
+    return [(t.buy_order.order_id, t.sell_order.order_id, t.amount_traded, t.selling_price)
+            for t in engine.trades]
+
+
+class MatchOrdersTest(unittest.TestCase):
+    def test_sweep_matches_naive_reference(self):
+        for seed in range(200):
+            batches = random_batches(seed)
+            expected = run(NaivePairEngine([], []), batches)
+            actual = run(PairEngine([], []), batches)
+            self.assertEqual(actual, expected, f"seed {seed}")
+
+    def test_sweep_leaves_no_crossing_orders_between_accounts(self):
+        for seed in range(50):
+            book = PairEngine([], [])
+            run(book, random_batches(seed))
+            resting = [o for levels in (book.bid_q, book.ask_q)
+                       for queue in levels.values() for o in queue]
+            buys = [o for o in resting if o.side == "BUY"]
+            sells = [o for o in resting if o.side == "SELL"]
+            for buy in buys:
+                for sell in sells:
+                    self.assertFalse(buy.account_id != sell.account_id
+                                     and buy.limit_price >= sell.limit_price)
+            self.assertEqual(sorted(book.bid_q), list(book.bids))
+            self.assertEqual(sorted(book.ask_q), list(book.asks))
+
+
+class PushOrdersTest(unittest.TestCase):
+    def test_bulk_insert_matches_per_order_push(self):
+        rng = random.Random(0)
+        bulk, single = PairEngine([], []), PairEngine([], [])
+        for k in range(20):
+            batch = [("CREATE", rng.choice("abc"), rng.randint(1, 20), f"{k}-{i}", "P",
+                      float(rng.randint(90, 110)), rng.choice(["BUY", "SELL"]))
+                     for i in range(rng.randint(1, 50))]
+            bulk._push_orders([Order(*fields) for fields in batch])
+            for fields in batch:
+                single._push_order(Order(*fields))
+
+            self.assertEqual(sorted(bulk.bid_q), list(bulk.bids))
+            self.assertEqual(sorted(bulk.ask_q), list(bulk.asks))
+            self.assertEqual(list(bulk.bids), list(single.bids))
+            self.assertEqual(list(bulk.asks), list(single.asks))
+            for side in ("bid_q", "ask_q"):
+                self.assertEqual(
+                    {price: [o.order_id for o in queue]
+                     for price, queue in getattr(bulk, side).items()},
+                    {price: [o.order_id for o in queue]
+                     for price, queue in getattr(single, side).items()})
+            self.assertEqual(
+                {acct: sorted(o.order_id for o in orders.values())
+                 for acct, orders in bulk.pending_by_account.items()},
+                {acct: sorted(o.order_id for o in orders.values())
+                 for acct, orders in single.pending_by_account.items()})
+
+    def test_add_orders_keeps_levels_sorted(self):
+        orch = OrderOrch()
+        orch.add_orders([Order("CREATE", "a", 5, "1", "P", 101.0, "BUY"),
+                         Order("CREATE", "b", 5, "2", "P", 99.0, "BUY"),
+                         Order("CREATE", "a", 5, "3", "P", 103.0, "SELL"),
+                         Order("CREATE", "b", 5, "4", "P", 102.0, "SELL"),
+                         Order("CREATE", "c", 5, "5", "P", 100.0, "BUY")])
+        book = orch.engines["P"]
+        self.assertEqual(list(book.bids), [99.0, 100.0, 101.0])
+        self.assertEqual(list(book.asks), [102.0, 103.0])
+        self.assertEqual(sorted(book.bid_q), list(book.bids))
+        self.assertEqual(sorted(book.ask_q), list(book.asks))
+        self.assertEqual(orch.trades, [])
+
+
+class MatchIncomingTest(unittest.TestCase):
+    def test_demo_data(self):
+        orch = OrderOrch()
+        for account_id, order_id, amount, price, side in [
+                ("karan", "1", 1000, 200.0, "BUY"),
+                ("mayank", "3", 200, 190.0, "SELL"),
+                ("david", "4", 111, 201.0, "SELL"),
+                ("karan", "5", 100, 190.0, "SELL"),
+                ("karan", "6", 111, 201.0, "BUY")]:
+            orch.add_order(Order("CREATE", account_id, amount, order_id, "REL", price, side))
+        # The last BUY @201 skips karan's own SELL @190 and fills david's
+        self.assertEqual([(t.buy_order.order_id, t.sell_order.order_id,
+                           t.amount_traded, t.selling_price) for t in orch.trades],
+                         [("1", "3", 200, 190.0), ("6", "4", 111, 201.0)])
+        self.assertEqual(sorted((row["order_id"], row["amount"])
+                                for row in orch.pending_orders()["karan"]),
+                         [("1", 800), ("5", 100)])
+
+    def test_matches_brute_force_reference(self):
+        for seed in range(100):
+            rng = random.Random(seed)
+            book = PairEngine([], [])
+            resting, expected = [], []
+            for seq in range(300):
+                fields = ("CREATE", rng.choice(["big", "big", "x", "y"]), rng.randint(1, 20),
+                          str(seq), "P", float(rng.randint(95, 105)), rng.choice(["BUY", "SELL"]))
+                book.add_order(Order(*fields))
+                reference_add_order(resting, expected, Order(*fields), seq)
+            actual = [(t.buy_order.order_id, t.sell_order.order_id, t.amount_traded,
+                       t.selling_price) for t in book.trades]
+            self.assertEqual(actual, expected, f"seed {seed}")
+            self.assertEqual(
+                sorted((o.order_id, o.amount) for levels in (book.bid_q, book.ask_q)
+                       for queue in levels.values() for o in queue),
+                sorted((o.order_id, o.amount) for _, o in resting))
+
+
+class OrderOrchTest(unittest.TestCase):
+    def test_orders_only_match_within_their_pair(self):
+        orch = OrderOrch()
+        orch.add_order(Order("CREATE", "a", 5, "1", "BTC", 100.0, "BUY"))
+        orch.add_order(Order("CREATE", "b", 5, "2", "ETH", 90.0, "SELL"))
+        orch.add_orders([Order("CREATE", "a", 3, "3", "ETH", 50.0, "SELL"),
+                         Order("CREATE", "c", 2, "4", "BTC", 200.0, "BUY"),
+                         Order("CREATE", "d", 4, "5", "BTC", 95.0, "SELL")])
+        self.assertTrue(orch.trades)
+        for t in orch.trades:
+            self.assertEqual(t.buy_order.pair, t.sell_order.pair)
+        self.assertEqual([(t.buy_order.order_id, t.sell_order.order_id, t.amount_traded)
+                          for t in orch.trades], [("4", "5", 2), ("1", "5", 2)])
+
+        pending = orch.pending_orders()
+        self.assertEqual(sorted((row["pair"], row["order_id"], row["amount"])
+                                for row in pending["a"]),
+                         [("BTC", "1", 3), ("ETH", "3", 3)])
+        self.assertEqual([row["order_id"] for row in pending["b"]], ["2"])
+
+
+if __name__ == "__main__":
+    unittest.main()